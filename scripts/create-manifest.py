@@ -1,20 +1,22 @@
 # scripts/create-manifest.py
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 from pathlib import Path
+from pyogrio.raw import read_arrow
 import sys
 
-# To import from the src directory, we add the project root to the system path.
-# This is a common pattern for making scripts runnable from the command line.
 project_root = Path(__file__).parent.parent
-sys.path.append(str(project_root))
-
-from src.rts_labeling_tool.data_management import load_and_filter_arts_data
 
 def create_manifest():
     """
-    Creates a master CSV manifest file for 'Positive' class RTS features
-    by using the data_management module.
+    Creates a master CSV manifest file for 'Positive' class RTS features.
+
+    Only the UIDs are needed, so just the 'UID' column of the 'Positive'
+    features is read from the ARTS GeoJSON, as Arrow and without geometries.
     """
     try:
         # --- 1. Define File Paths ---
@@ -29,19 +31,30 @@ def create_manifest():
                 print("Operation cancelled by user.")
                 return
 
-        # --- 3. Load and Filter Data using the dedicated function ---
-        gdf_positive = load_and_filter_arts_data(geojson_path)
-
-        if gdf_positive is None:
-            print("Failed to load or filter data. Aborting manifest creation.", file=sys.stderr)
+        # --- 3. Read the 'Positive' UIDs from the GeoJSON ---
+        if not geojson_path.exists():
+            print(f"Error: GeoJSON file not found at {geojson_path}", file=sys.stderr)
             return
 
+        _, table = read_arrow(
+            geojson_path,
+            columns=["UID"],
+            read_geometry=False,
+            where="TrainClass = 'Positive'"
+        )
+
         # --- 4. Extract Unique UIDs ---
-        if 'UID' not in gdf_positive.columns:
+        if 'UID' not in table.column_names:
             print("Error: 'UID' column not found in the filtered GeoJSON file.", file=sys.stderr)
             return
-            
-        unique_uids = gdf_positive['UID'].unique()
+
+        # Uniques are taken on the Arrow column, in first-seen order. A
+        # dictionary-encoded column already holds them as its dictionary.
+        uid_column = table.column('UID').combine_chunks()
+        if pa.types.is_dictionary(uid_column.type):
+            unique_uids = uid_column.dictionary.to_pylist()
+        else:
+            unique_uids = pc.unique(pc.drop_null(uid_column)).to_pylist()
         print(f"Found {len(unique_uids)} unique UIDs in the 'Positive' class.")
 
         # --- 5. Create the Manifest DataFrame ---
@@ -55,18 +68,31 @@ def create_manifest():
             'notes'
         ]
         
-        manifest_df = pd.DataFrame(unique_uids, columns=['uid'])
-        manifest_df['labeling_status'] = 'unprocessed'
-        
-        for col in manifest_columns:
-            if col not in manifest_df.columns:
-                manifest_df[col] = ''
-        
-        manifest_df = manifest_df[manifest_columns]
+        # Build every column up front so the frame is constructed only once.
+        n_uids = len(unique_uids)
+        empty_column = np.full(n_uids, '', dtype=object)
+        manifest_df = pd.DataFrame({
+            'uid': np.asarray(unique_uids, dtype=object),
+            'labeling_status': np.full(n_uids, 'unprocessed', dtype=object),
+            'worker_id': empty_column,
+            'start_time_utc': empty_column,
+            'end_time_utc': empty_column,
+            'output_filename': empty_column,
+            'notes': empty_column
+        }, columns=manifest_columns)
 
         # --- 6. Save the Manifest File ---
         print(f"Saving manifest file to: {manifest_path}")
-        manifest_df.to_csv(manifest_path, index=False)
+        # pyarrow writes the table column by column in C++. Values are never
+        # quoted, which matches the pandas output for UIDs and status strings;
+        # the header is written here because pyarrow always quotes it.
+        with open(manifest_path, 'wb') as f:
+            f.write((','.join(manifest_columns) + '\n').encode('utf-8'))
+            pacsv.write_csv(
+                pa.Table.from_pandas(manifest_df, preserve_index=False),
+                f,
+                write_options=pacsv.WriteOptions(include_header=False, quoting_style="none")
+            )
 
         print("\nManifest file created successfully!")
         print(f"Total tasks to process: {len(manifest_df)}")
@@ -1,60 +1,118 @@
 # src/interactive_label_sam2/data_management.py
 
 import geopandas as gpd
-import json
+import shapely
 import sys
+from pyogrio import read_dataframe
+from pyogrio.errors import DataSourceError
 from pathlib import Path
 from shapely.geometry import Point
 from typing import Union, List, Tuple
 
+def read_parquet_cache(source_path: Path, parquet_path: Path) -> Union[gpd.GeoDataFrame, None]:
+    """
+    Reads the GeoParquet cache of a source file if it is newer than the source.
+
+    Returns:
+        Union[gpd.GeoDataFrame, None]: The cached frame, or None if there is no
+                                       current cache or it cannot be read.
+    """
+    if parquet_path.exists() and parquet_path.stat().st_mtime >= source_path.stat().st_mtime:
+        try:
+            return gpd.read_parquet(parquet_path)
+        except Exception as e:
+            print(f"Warning: Could not read cache {parquet_path.name}, reloading {source_path.name}. Error: {e}", file=sys.stderr)
+    return None
+
+def write_parquet_cache(gdf: gpd.GeoDataFrame, parquet_path: Path, compression: str = 'snappy'):
+    """
+    Writes a frame as the GeoParquet cache, warning instead of failing if it cannot.
+    """
+    try:
+        gdf.to_parquet(parquet_path, compression=compression)
+    except Exception as e:
+        print(f"Warning: Could not write cache {parquet_path.name}. Error: {e}", file=sys.stderr)
+
+def index_by_uid(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Indexes and sorts a frame by its UID column, so per-UID lookups use a
+    binary search. The column is kept and the index is left unnamed, so
+    'UID' still refers only to the column.
+    """
+    return gdf.set_index('UID', drop=False).rename_axis(None).sort_index(kind='stable')
+
+def is_indexed_by_uid(gdf: gpd.GeoDataFrame) -> bool:
+    """
+    Checks whether a frame carries the sorted UID index set by index_by_uid,
+    so UID rows can be taken with a label slice.
+    """
+    index = gdf.index
+    return (
+        len(index) > 0
+        and index.is_monotonic_increasing
+        and index[0] == gdf['UID'].iloc[0]
+        and index[-1] == gdf['UID'].iloc[-1]
+    )
+
+def select_uid_rows(gdf: gpd.GeoDataFrame, uid: str) -> gpd.GeoDataFrame:
+    """
+    Returns all rows of a frame for one UID, from the sorted UID index when
+    the frame has one and by filtering the UID column otherwise.
+    """
+    if is_indexed_by_uid(gdf):
+        # Unknown labels cannot be sliced on a categorical index, so check first.
+        if uid not in gdf.index:
+            return gdf.iloc[:0]
+        return gdf.loc[uid:uid]
+    return gdf[gdf['UID'] == uid]
+
 def load_and_filter_arts_data(geojson_path: Path) -> Union[gpd.GeoDataFrame, None]:
     """
     Loads the ARTS GeoJSON dataset, validates it, and filters for features
-    marked as 'Positive'.
+    marked as 'Positive'. The filtered result is cached as GeoParquet next to
+    the GeoJSON and reused while it is newer than the source file.
 
     Args:
         geojson_path (Path): The full path to the GeoJSON file.
 
     Returns:
         Union[gpd.GeoDataFrame, None]: A GeoDataFrame containing only the 'Positive'
-                                       class features, or None if an error occurs.
+                                       class features, indexed and sorted by UID,
+                                       or None if an error occurs.
     """
     # --- 1. Validate File Existence ---
     if not geojson_path.exists():
         print(f"Error: GeoJSON file not found at {geojson_path}", file=sys.stderr)
         return None
 
-    # --- 2. Validate as a standard JSON file ---
-    try:
-        with open(geojson_path, 'r', encoding='utf-8') as f:
-            json.load(f)
-        # This print statement can be removed in production if too verbose
-        # print("File successfully validated as a JSON.")
-    except json.JSONDecodeError as e:
-        print(f"\nFATAL ERROR: The file is not a valid JSON. Error: {e}", file=sys.stderr)
-        return None
-    except Exception as e:
-        print(f"\nFATAL ERROR: Could not read the file. Error: {e}", file=sys.stderr)
-        return None
-
-    # --- 3. Load with GeoPandas and Filter ---
-    try:
-        gdf = gpd.read_file(geojson_path, engine="pyogrio")
-        # print("GeoJSON file loaded successfully with GeoPandas.")
-
-        if 'TrainClass' not in gdf.columns:
-            print("Error: 'TrainClass' column not found.", file=sys.stderr)
+    # --- 2. Reuse the GeoParquet cache if it is newer than the GeoJSON ---
+    parquet_path = geojson_path.with_suffix(".positive.parquet")
+    gdf_positive = read_parquet_cache(geojson_path, parquet_path)
+
+    # --- 3. Load with pyogrio and Filter ---
+    if gdf_positive is None:
+        try:
+            # The 'Positive' filter is pushed down to GDAL and only the needed
+            # columns are materialized, streamed in as Arrow record batches.
+            gdf_positive = read_dataframe(
+                geojson_path,
+                use_arrow=True,
+                where="TrainClass = 'Positive'",
+                columns=["UID", "TrainClass"]
+            )
+            # print(f"Found {len(gdf_positive)} polygons marked as 'Positive'.")
+        except DataSourceError as e:
+            print(f"\nFATAL ERROR: The file is not a valid GeoJSON. Error: {e}", file=sys.stderr)
+            return None
+        except Exception as e:
+            print(f"\nAn unexpected error occurred during GeoPandas processing: {e}", file=sys.stderr)
             return None
-        
-        # print(f"Total polygons found in file: {len(gdf)}")
-        gdf_positive = gdf[gdf['TrainClass'] == 'Positive'].copy()
-        # print(f"Found {len(gdf_positive)} polygons marked as 'Positive'.")
-        
-        return gdf_positive
 
-    except Exception as e:
-        print(f"\nAn unexpected error occurred during GeoPandas processing: {e}", file=sys.stderr)
-        return None
+        # --- 4. Cache the filtered result for the next run ---
+        write_parquet_cache(gdf_positive, parquet_path)
+
+    # --- 5. Index by UID so per-UID lookups use a binary search ---
+    return index_by_uid(gdf_positive)
 
 def get_feature_info(uid: str, gdf: gpd.GeoDataFrame) -> Union[Tuple[List[gpd.GeoSeries], Point], None]:
     """
@@ -65,7 +123,8 @@ def get_feature_info(uid: str, gdf: gpd.GeoDataFrame) -> Union[Tuple[List[gpd.Ge
 
     Args:
         uid (str): The unique identifier for the RTS feature.
-        gdf (gpd.GeoDataFrame): The GeoDataFrame containing all positive features.
+        gdf (gpd.GeoDataFrame): The GeoDataFrame containing all positive features,
+                                as returned by load_and_filter_arts_data.
 
     Returns:
         Union[Tuple, None]: A tuple containing:
@@ -73,8 +132,8 @@ def get_feature_info(uid: str, gdf: gpd.GeoDataFrame) -> Union[Tuple[List[gpd.Ge
                             - The calculated centroid (Shapely Point).
                             Returns None if the UID is not found.
     """
-    # Filter the dataframe to get all entries for the specified UID
-    feature_gdf = gdf[gdf['UID'] == uid]
+    # Get all entries for the specified UID
+    feature_gdf = select_uid_rows(gdf, uid)
 
     if feature_gdf.empty:
         print(f"Error: No feature found for UID: {uid}", file=sys.stderr)
@@ -83,11 +142,9 @@ def get_feature_info(uid: str, gdf: gpd.GeoDataFrame) -> Union[Tuple[List[gpd.Ge
     # Get all the historical polygon geometries
     historical_polygons = list(feature_gdf.geometry)
 
-    # Combine all historical polygons into one single geometry
-    # The unary_union is a robust way to merge multiple geometries
-    combined_geometry = feature_gdf.geometry.unary_union
-
-    # Calculate the centroid of the combined shape
-    centroid = combined_geometry.centroid
+    # Combine all historical polygons into one single geometry and take the
+    # centroid of the combined shape. The outlines of one feature overlap,
+    # so a mean of the per-polygon centroids would differ from it.
+    centroid = shapely.union_all(feature_gdf.geometry.values).centroid
 
     return historical_polygons, centroid
@@ -1,44 +1,207 @@
 # src/interactive_label_sam2/gcs_utils.py
 
 import geopandas as gpd
+import numpy as np
+import pandas as pd
 import rasterio
-from rasterio.windows import from_bounds
+from pyogrio import read_dataframe
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from rasterio.transform import Affine
 from shapely.geometry import Point, Polygon
 from pathlib import Path
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import functools
+import hashlib
+import re
 import sys
-from typing import Union, List, Tuple
+import threading
+import time
+from typing import Union, Callable, Dict, List, Optional, Tuple
 
-import gcsfs
 import google.auth
 import google.auth.transport.requests
+from google.cloud import storage
+
+from .data_management import index_by_uid, read_parquet_cache, select_uid_rows, write_parquet_cache
+
+# Four-digit years anywhere in a blob path, e.g. 'global_quarterly_2020q3_mosaic'.
+_YEAR_PATTERN = re.compile(r"(?<!\d)(\d{4})(?!\d)")
+# Planet quad ids in a blob file name, e.g. '..._mosaic_337-1622_quad.tif'.
+_QUAD_ID_PATTERN = re.compile(r"(?<![\d-])(\d+-\d+)(?![\d-])")
+
+# Local copy of the bucket listing, refreshed once it is older than a day.
+BLOB_CACHE_DIR = Path.home() / ".cache" / "interactive-sam2"
+BLOB_CACHE_MAX_AGE_SECONDS = 24 * 60 * 60
+
+# Upper bound on concurrent tile reads in get_tile_from_paths.
+MAX_TILE_READ_WORKERS = 8
+
+# GDAL settings for reading COGs through /vsigs/ with HTTP range requests
+# for just the blocks under the read window.
+GDAL_COG_OPTIONS = {
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif',
+    'CPL_VSIL_CURL_USE_HEAD': 'NO',
+    # Fetch the COG header and tile index in one GET when the file is opened.
+    'GDAL_INGESTED_BYTES_AT_OPEN': '32768',
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'GDAL_HTTP_MULTIPLEX': 'YES',
+    'GDAL_HTTP_VERSION': '2',
+    # Retry transient GCS errors (e.g. 429/503) instead of rejecting the tile,
+    # after a short delay rather than GDAL's default of 30 seconds.
+    'GDAL_HTTP_MAX_RETRY': '2',
+    'GDAL_HTTP_RETRY_DELAY': '0.5',
+    'VSI_CACHE': 'TRUE',
+    'VSI_CACHE_SIZE': str(64 * 1024 * 1024),
+}
+
+# Number of opened COGs kept around for reuse by later tile reads.
+MAX_OPEN_DATASETS = 16
+
+# Columns of the correspondence data held as pandas categoricals.
+CORRESPONDENCE_CATEGORICAL_DTYPES = {'UID': 'category', 'id': 'category'}
+
+# Serializes OAuth token refreshes between concurrent tile reads.
+_CREDENTIALS_LOCK = threading.Lock()
+
+# Process-wide cache of open datasets, least recently used first. GDAL fixes a
+# /vsigs/ handle's request headers when it is opened, so handles are keyed by
+# (/vsigs/ path, OAuth token) and one is only reused with the token it sends.
+# Each handle has its own lock, since a GDAL dataset must not be read from two
+# threads at once.
+_DATASET_CACHE: "OrderedDict[Tuple[str, str], Tuple[rasterio.io.DatasetReader, threading.Lock]]" = OrderedDict()
+_DATASET_CACHE_LOCK = threading.Lock()
+
+def _get_cached_dataset(key: Tuple[str, str]) -> Tuple[rasterio.io.DatasetReader, threading.Lock]:
+    """
+    Returns the cached dataset for a (path, token) key, opening and caching
+    it on a miss. Must be called in a GDAL environment sending that token.
+    Handles evicted to stay within MAX_OPEN_DATASETS are closed.
+    """
+    with _DATASET_CACHE_LOCK:
+        entry = _DATASET_CACHE.get(key)
+        if entry is not None:
+            _DATASET_CACHE.move_to_end(key)
+            return entry
+
+    # Opening is a network round-trip, so it happens outside the cache lock.
+    src = rasterio.open(key[0])
+
+    evicted = []
+    with _DATASET_CACHE_LOCK:
+        entry = _DATASET_CACHE.setdefault(key, (src, threading.Lock()))
+        _DATASET_CACHE.move_to_end(key)
+        # The entry just used is most recent, so it is never evicted here.
+        while len(_DATASET_CACHE) > max(MAX_OPEN_DATASETS, 1):
+            evicted.append(_DATASET_CACHE.popitem(last=False)[1])
+
+    if entry[0] is not src:
+        # Another thread cached this path while we were opening it.
+        src.close()
+    _close_datasets(evicted)
+    return entry
+
+def _discard_cached_datasets(should_discard: Callable[[Tuple[str, str]], bool]):
+    """
+    Removes and closes the cached datasets whose (path, token) key matches.
+    """
+    with _DATASET_CACHE_LOCK:
+        keys = [key for key in _DATASET_CACHE if should_discard(key)]
+        discarded = [_DATASET_CACHE.pop(key) for key in keys]
+    _close_datasets(discarded)
+
+def _close_datasets(entries: List[Tuple[rasterio.io.DatasetReader, threading.Lock]]):
+    """
+    Closes datasets removed from the cache, waiting for any read in progress.
+    """
+    for src, dataset_lock in entries:
+        with dataset_lock:
+            src.close()
+
+@contextlib.contextmanager
+def _cached_dataset(key: Tuple[str, str]):
+    """
+    Context manager that holds a cached dataset's lock while it is in use.
+    """
+    while True:
+        src, dataset_lock = _get_cached_dataset(key)
+        with dataset_lock:
+            # The handle may have been evicted and closed since the lookup.
+            if not src.closed:
+                yield src
+                return
+
+@functools.lru_cache(maxsize=None)
+def _get_gcs_session(project_id: str) -> Tuple[object, str, storage.Client]:
+    """
+    Authenticates with Application Default Credentials and builds a
+    storage client once per project, so every GCSImageLoader in the process
+    shares one token and one HTTP connection pool.
+
+    Returns:
+        Tuple: (credentials, effective project id, storage client)
+    """
+    scopes = ['https://www.googleapis.com/auth/cloud-platform']
+    credentials, discovered_project_id = google.auth.default(scopes=scopes)
+    if not credentials.valid:
+        credentials.refresh(google.auth.transport.requests.Request())
+
+    project_id = discovered_project_id if discovered_project_id else project_id
+    return credentials, project_id, storage.Client(project=project_id, credentials=credentials)
 
 class GCSImageLoader:
     """
     A class to efficiently find and load Planet image tiles from GCS.
     This design is inspired by the user's successful batch processing script.
     """
-    def __init__(self, project_id: str, bucket_name: str, search_prefix: str):
+    def __init__(self, project_id: str, bucket_name: str, search_prefix: str, force_refresh: bool = False):
         """
         Initializes the loader by authenticating and pre-fetching a list of all
         relevant blob paths to enable fast, in-memory searching.
+
+        The listing is cached under BLOB_CACHE_DIR for BLOB_CACHE_MAX_AGE_SECONDS;
+        pass force_refresh=True to list the bucket again regardless.
         """
         self.project_id = project_id
         self.bucket_name = bucket_name
         self.blob_paths = []
+        self._path_index: Dict[Tuple[int, str], List[str]] = defaultdict(list)
 
         try:
             print("--- Initializing GCSImageLoader ---")
-            scopes = ['https://www.googleapis.com/auth/cloud-platform']
-            credentials, discovered_project_id = google.auth.default(scopes=scopes)
-            if not credentials.valid:
-                credentials.refresh(google.auth.transport.requests.Request())
-            
-            self.project_id = discovered_project_id if discovered_project_id else self.project_id
-            self.gcs = gcsfs.GCSFileSystem(project=self.project_id, token=credentials)
+            self.credentials, self.project_id, self.storage_client = _get_gcs_session(self.project_id)
             
-            print(f"Pre-fetching all blob paths from gs://{self.bucket_name}/{search_prefix}...")
             full_prefix_path = f"{self.bucket_name}/{search_prefix}"
-            self.blob_paths = self.gcs.glob(f"{full_prefix_path}/**/*.tif")
+            cache_key = hashlib.sha1(full_prefix_path.encode()).hexdigest()
+            cache_file = BLOB_CACHE_DIR / f"blob_paths.{cache_key}.txt"
+
+            if (not force_refresh and cache_file.exists()
+                    and time.time() - cache_file.stat().st_mtime < BLOB_CACHE_MAX_AGE_SECONDS):
+                print(f"Loading cached blob paths from {cache_file}...")
+                self.blob_paths = cache_file.read_text().splitlines()
+            else:
+                print(f"Pre-fetching all blob paths from gs://{self.bucket_name}/{search_prefix}...")
+                # One paged listing of the prefix; only object names are
+                # requested, and paths keep the 'bucket/name' form of the cache.
+                blobs = self.storage_client.list_blobs(
+                    self.bucket_name,
+                    prefix=f"{search_prefix.rstrip('/')}/",
+                    fields="items(name),nextPageToken"
+                )
+                self.blob_paths = [
+                    f"{self.bucket_name}/{blob.name}" for blob in blobs if blob.name.endswith(".tif")
+                ]
+                try:
+                    cache_file.parent.mkdir(parents=True, exist_ok=True)
+                    cache_file.write_text("\n".join(self.blob_paths))
+                except OSError as e:
+                    print(f"Warning: Could not write blob path cache. Error: {e}", file=sys.stderr)
+
+            self._build_path_index()
             print(f"Found {len(self.blob_paths)} total .tif files. Ready for fast searching.")
             print("--- GCSImageLoader Initialized Successfully ---\n")
 
@@ -46,97 +209,236 @@ class GCSImageLoader:
             print(f"FATAL: Failed to initialize GCSImageLoader. Error: {e}", file=sys.stderr)
             raise
 
+    def _build_path_index(self):
+        """
+        Indexes the pre-fetched quad paths by (year, image_id) so that each
+        lookup in find_image_paths is a single dictionary access.
+        """
+        self._path_index.clear()
+        # Thousands of quads share each mosaic directory, so the years in a
+        # directory name are parsed once. A year cannot span a '/', so the
+        # directory and file name years together are those of the full path.
+        directory_years: Dict[str, set] = {}
+        for path in self.blob_paths:
+            directory, _, file_name = path.rpartition('/')
+            if 'quad' not in file_name:
+                continue
+            years = directory_years.get(directory)
+            if years is None:
+                years = directory_years[directory] = {int(year) for year in _YEAR_PATTERN.findall(directory)}
+            path_years = years.union(map(int, _YEAR_PATTERN.findall(file_name)))
+            for image_id in set(_QUAD_ID_PATTERN.findall(file_name)):
+                for year in path_years:
+                    self._path_index[(year, image_id)].append(path)
+
     def find_image_paths(self, image_info_list: List[dict]) -> List[str]:
         """
-        Searches the pre-fetched in-memory list of paths for the required images.
+        Looks up the required images in the index of pre-fetched paths.
+
+        Image ids that are not '<x>-<y>' quad ids, and so cannot be in the
+        index, fall back to one scan of the listing that matches the year,
+        image_id and 'quad' anywhere in the path. Quad ids missing from the
+        index are not in the bucket and are not searched for again.
         """
         all_found_paths = []
+        unindexed = []
         for info in image_info_list:
-            year = info['year']
-            image_id = info['image_id']
-            
-            found = [
-                path for path in self.blob_paths
-                if str(year) in path and image_id in path and 'quad' in path
-            ]
-            if found:
-                all_found_paths.extend(found)
+            if _QUAD_ID_PATTERN.fullmatch(info['image_id']):
+                all_found_paths.extend(self._path_index.get((int(info['year']), info['image_id']), []))
+            else:
+                unindexed.append(info)
+
+        if unindexed:
+            # A single compiled pattern tests every unindexed image per path.
+            pattern = re.compile("|".join(
+                rf"(?=.*{re.escape(str(info['year']))})(?=.*{re.escape(info['image_id'])})(?=.*quad)"
+                for info in unindexed
+            ))
+            all_found_paths.extend(path for path in self.blob_paths if pattern.match(path))
         
         unique_paths = sorted(list(set(all_found_paths)))
         print(f"Found {len(unique_paths)} matching image path(s): {unique_paths}")
         return unique_paths
 
-    def get_tile_from_paths(self, gcs_paths: List[str], aoi_polygon_gdf: gpd.GeoDataFrame) -> Union[Tuple[object, object], None]:
+    def _current_token(self) -> str:
+        """
+        Returns a valid OAuth token, refreshing the credentials if needed.
+        Cached datasets opened with the expired token are closed on refresh.
+        """
+        with _CREDENTIALS_LOCK:
+            if not self.credentials.valid:
+                expired_token = self.credentials.token
+                self.credentials.refresh(google.auth.transport.requests.Request())
+                _discard_cached_datasets(lambda key: key[1] == expired_token)
+            return self.credentials.token
+
+    def _gdal_env(self, token: str) -> rasterio.Env:
+        """
+        Returns a rasterio environment that lets GDAL read from GCS directly.
+
+        GDAL is handed the loader's own OAuth token as a request header, so
+        /vsigs/ needs no separate credential setup.
+        """
+        return rasterio.Env(
+            GS_NO_SIGN_REQUEST='YES',
+            GDAL_HTTP_HEADERS=f"Authorization: Bearer {token}",
+            **GDAL_COG_OPTIONS
+        )
+
+    def _read_tile(self, path: str, aoi_polygon_gdf: gpd.GeoDataFrame, bands: Tuple[int, ...] = (1, 2, 3),
+                   out: Optional[np.ndarray] = None) -> Union[Tuple[object, object], None]:
+        """
+        Reads the AOI window from a single GCS path, returning None if the
+        read fails or the window is empty. See get_tile_from_paths for
+        `bands` and `out`.
+
+        The raster is wrapped in a WarpedVRT in the AOI's CRS, so the window
+        is taken straight from the AOI bounds and GDAL resamples the pixels.
+        The underlying dataset stays open for later reads of the same path
+        with the same token, and is discarded if a read from it fails.
+        """
+        dataset_key = None
+        try:
+            token = self._current_token()
+            dataset_key = (f"/vsigs/{path.removeprefix('gs://')}", token)
+            with self._gdal_env(token), _cached_dataset(dataset_key) as src, \
+                    WarpedVRT(src, crs=aoi_polygon_gdf.crs, resampling=Resampling.bilinear) as vrt:
+                print(f"\n--- Processing Image: {Path(path).name} ---")
+                print(f"Vector CRS: {aoi_polygon_gdf.crs} | Raster CRS: {src.crs}")
+
+                aoi_bounds = aoi_polygon_gdf.total_bounds
+                print(f"Reading window with bounds: {aoi_bounds}")
+
+                # Define the read window using the polygon's bounds. A warped
+                # VRT is always north-up, so the pixel offsets follow directly
+                # from the transform and the window's transform is anchored
+                # at the AOI's top-left corner.
+                left, bottom, right, top = aoi_bounds
+                transform = vrt.transform
+                window = Window(
+                    col_off=(left - transform.c) / transform.a,
+                    row_off=(top - transform.f) / transform.e,
+                    width=max((right - left) / transform.a, 0.0),
+                    height=max((bottom - top) / transform.e, 0.0)
+                )
+                window_transform = Affine(transform.a, 0.0, left, 0.0, transform.e, top)
+
+                # Read only the requested bands from that window; by default the
+                # RGB bands, since downstream code never uses the 4th (NIR) band.
+                band_indexes = [band for band in bands if band <= vrt.count]
+
+                # A buffer of any other shape would make GDAL resample the tile.
+                tile_size = window.round_lengths()
+                tile_shape = (len(band_indexes), int(tile_size.height), int(tile_size.width))
+                if out is not None and (out.shape != tile_shape or out.dtype != vrt.dtypes[0]):
+                    out = None
+                data = vrt.read(indexes=band_indexes, window=window, out=out)
+
+                if data.shape[1] == 0 or data.shape[2] == 0:
+                    print("Warning: Read an empty tile. The AOI may not overlap with the image data.", file=sys.stderr)
+                    return None
+
+                # Get the profile for this specific window to save later. The
+                # source profile is used because the VRT's names the VRT driver.
+                profile = src.profile
+                profile.update({
+                    'count': data.shape[0],
+                    'height': data.shape[1],
+                    'width': data.shape[2],
+                    'transform': window_transform,
+                    'crs': vrt.crs
+                })
+
+                print(f"Successfully read tile from {path}")
+                return data, profile
+        except Exception as e:
+            print(f"Could not read tile from {path}. Error: {e}", file=sys.stderr)
+            # A handle that failed may be left broken, so the next read reopens.
+            _discard_cached_datasets(lambda key: key == dataset_key)
+            return None
+
+    def get_tile_from_paths(self, gcs_paths: List[str], aoi_polygon_gdf: gpd.GeoDataFrame,
+                            bands: Tuple[int, ...] = (1, 2, 3),
+                            out: Optional[np.ndarray] = None) -> Union[Tuple[object, object], None]:
         """
         Reads a tile from a list of GCS paths, using the bounds of the
-        provided Area of Interest (AOI) GeoDataFrame. It ensures CRS alignment.
+        provided Area of Interest (AOI) GeoDataFrame. The tile is returned
+        in the AOI's CRS.
+
+        All paths are read concurrently, since GDAL releases the GIL during
+        network I/O. The tile from the first path (in the given order) that
+        reads successfully is returned; reads that have not started by then
+        are cancelled and those in flight are not waited for.
+
+        Args:
+            gcs_paths (List[str]): Candidate image paths, in order of preference.
+            aoi_polygon_gdf (gpd.GeoDataFrame): The AOI to read.
+            bands (Tuple[int, ...]): 1-based band indexes to read; bands the
+                image does not have are skipped.
+            out (np.ndarray, optional): A buffer from an earlier tile to reuse.
+                The first path reads into it when its shape and dtype match
+                the tile; otherwise a new array is returned.
         """
         if not gcs_paths:
             return None
-        
-        for path in gcs_paths:
-            try:
-                with self.gcs.open(path, 'rb') as f:
-                    with rasterio.open(f) as src:
-                        print(f"\n--- Processing Image: {Path(path).name} ---")
-                        print(f"Vector CRS: {aoi_polygon_gdf.crs} | Raster CRS: {src.crs}")
-
-                        # Ensure the AOI polygon is in the same CRS as the raster
-                        if aoi_polygon_gdf.crs != src.crs:
-                            print("CRS mismatch detected. Reprojecting AOI polygon...")
-                            aoi_reprojected = aoi_polygon_gdf.to_crs(src.crs)
-                        else:
-                            aoi_reprojected = aoi_polygon_gdf
-
-                        # Get the bounding box of the (potentially reprojected) AOI
-                        aoi_bounds = aoi_reprojected.total_bounds
-                        print(f"Reading window with bounds: {aoi_bounds}")
-
-                        # Define the read window using the polygon's bounds
-                        window = from_bounds(*aoi_bounds, src.transform)
-
-                        # Read the data from that window
-                        data = src.read(window=window)
-                        
-                        if data.shape[1] == 0 or data.shape[2] == 0:
-                            print("Warning: Read an empty tile. The AOI may not overlap with the image data.", file=sys.stderr)
-                            continue
-
-                        # Get the profile for this specific window to save later
-                        profile = src.profile
-                        profile.update({
-                            'height': data.shape[1],
-                            'width': data.shape[2],
-                            'transform': src.window_transform(window),
-                            'crs': src.crs
-                        })
-
-                        print(f"Successfully read tile from {path}")
-                        return data, profile
-            except Exception as e:
-                print(f"Could not read tile from {path}. Error: {e}", file=sys.stderr)
-                continue
-        
+
+        executor = ThreadPoolExecutor(max_workers=min(MAX_TILE_READ_WORKERS, len(gcs_paths)))
+        try:
+            futures = [
+                # Only the preferred path may fill the caller's buffer.
+                executor.submit(self._read_tile, path, aoi_polygon_gdf, bands, out if i == 0 else None)
+                for i, path in enumerate(gcs_paths)
+            ]
+            for future in futures:
+                tile_data = future.result()
+                if tile_data is not None:
+                    return tile_data
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
         print(f"Error: Could not read a tile for the given AOI from any of the provided paths.", file=sys.stderr)
         return None
 
 def load_correspondence_data(correspondence_path: Path) -> Union[gpd.GeoDataFrame, None]:
     """
     Loads the UID-to-basemap correspondence GeoJSON file and enforces EPSG:3413.
+    A GeoParquet copy is written next to the GeoJSON and reused on later runs.
+    The returned frame is indexed and sorted by UID (the column is kept), and
+    the UID and id columns are categorical.
     """
     if not correspondence_path.exists():
         print(f"Error: Correspondence file not found at {correspondence_path}", file=sys.stderr)
         return None
     
+    # Reuse the GeoParquet cache if it is newer than the GeoJSON
+    parquet_path = correspondence_path.with_suffix(".parquet")
     try:
-        gdf = gpd.read_file(correspondence_path, engine="pyogrio")
-        
+        gdf = read_parquet_cache(correspondence_path, parquet_path)
+        if gdf is None:
+            gdf = read_dataframe(
+                correspondence_path,
+                use_arrow=True,
+                columns=["UID", "id", "planet_basemap_year"]
+            )
+            # Categorical ids are stored once and compared as integer codes;
+            # GeoParquet keeps them as dictionary-encoded columns.
+            gdf = gdf.astype(CORRESPONDENCE_CATEGORICAL_DTYPES)
+            write_parquet_cache(gdf, parquet_path, compression='zstd')
+
         # Enforce the correct CRS, as requested by the user.
         if gdf.crs != "EPSG:3413":
             print(f"Warning: Original CRS is {gdf.crs}. Forcing to EPSG:3413.")
             gdf = gdf.set_crs("EPSG:3413", allow_override=True)
 
-        print(f"Correspondence file loaded successfully with CRS: {gdf.crs}")
+        # No-op for a current cache, but guarantees the categorical columns.
+        gdf = gdf.astype(CORRESPONDENCE_CATEGORICAL_DTYPES)
+
+        # Years are stored as floats in the GeoJSON; compare them as integers.
+        gdf['planet_basemap_year'] = gdf['planet_basemap_year'].astype(np.int32)
+
+        gdf = index_by_uid(gdf)
+
+        print(f"Correspondence file loaded successfully with CRS: {gdf.crs.to_string()}")
         return gdf
     except Exception as e:
         print(f"Error loading correspondence file: {e}", file=sys.stderr)
@@ -145,37 +447,36 @@ def load_correspondence_data(correspondence_path: Path) -> Union[gpd.GeoDataFram
 def get_image_info_for_uid(uid: str, correspondence_gdf: gpd.GeoDataFrame) -> List[dict]:
     """
     Finds the necessary info (year, image_id) to locate basemap images for a given UID.
+    Rows are taken from the sorted UID index of load_correspondence_data's
+    frame, or by filtering the UID column of any other frame.
     """
-    uid_features = correspondence_gdf[correspondence_gdf['UID'] == uid].copy()
-
+    uid_features = select_uid_rows(correspondence_gdf, uid)
     if uid_features.empty:
         print(f"Warning: No basemap correspondence found for UID: {uid}", file=sys.stderr)
         return []
 
-    image_id_year_mapping = uid_features.groupby('id')['planet_basemap_year'].apply(list).to_dict()
-
-    if not image_id_year_mapping:
-        print(f"Warning: No planet image IDs found for UID {uid}", file=sys.stderr)
-        return []
+    # Distinct (image id, year) pairs, computed on the integer category codes.
+    # The loader's id column is already categorical; other frames are
+    # converted here, for the UID's rows only.
+    id_column = uid_features['id']
+    if not isinstance(id_column.dtype, pd.CategoricalDtype):
+        id_column = id_column.astype(CORRESPONDENCE_CATEGORICAL_DTYPES['id'])
+    category_codes, id_codes = np.unique(id_column.cat.codes.to_numpy(), return_inverse=True)
+    image_ids = id_column.cat.categories[category_codes]
+    years = uid_features['planet_basemap_year'].to_numpy()
+    pair_codes, pair_years = np.unique(np.stack([id_codes, years]), axis=1)
 
-    year_sets = [set(years) for years in image_id_year_mapping.values()]
-    common_years = list(set.intersection(*year_sets)) if year_sets else []
-
-    selected_year = None
-    if common_years:
-        selected_year = max(common_years)
-    else:
-        all_years = [year for years_list in image_id_year_mapping.values() for year in years_list]
-        if all_years:
-            selected_year = max(all_years)
+    # Prefer the latest year shared by every image, else the latest year overall.
+    # A year is shared by every image when it appears in as many pairs as there are images.
+    distinct_years, images_per_year = np.unique(pair_years, return_counts=True)
+    common_years = distinct_years[images_per_year == image_ids.size]
+    selected_year = common_years.max() if common_years.size else years.max()
 
     if not selected_year:
         print(f"Error: No available years found for UID {uid}", file=sys.stderr)
         return []
 
-    image_info_list = []
-    for image_id, years in image_id_year_mapping.items():
-        if selected_year in years:
-            image_info_list.append({'year': int(selected_year), 'image_id': image_id})
-            
-    return image_info_list
+    return [
+        {'year': int(selected_year), 'image_id': image_id}
+        for image_id in image_ids[pair_codes[pair_years == selected_year]]
+    ]
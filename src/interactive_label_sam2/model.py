@@ -1,10 +1,18 @@
 # src/interactive_label_sam2/model.py
 
+import contextlib
+import hashlib
+import threading
+from collections import OrderedDict
 import torch
+import torch.nn.functional as F
 from transformers import SamModel, SamProcessor
-from PIL import Image
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import Hashable, List, Tuple, Optional
+
+# Number of image embeddings kept, so returning to a recently labeled tile
+# does not re-run the image encoder.
+EMBEDDING_CACHE_SIZE = 8
 
 class SAM2Model:
     """
@@ -22,59 +30,215 @@ class SAM2Model:
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
             print(f"Using device: {self.device}")
 
+            # Half precision uses the GPU's tensor cores; the CPU stays in FP32.
+            self.dtype = torch.float16 if self.device == "cuda" else torch.float32
+
             print(f"Loading model: {model_name}...")
             self.model = SamModel.from_pretrained(model_name).to(self.device)
+            self.model = self.model.to(self.dtype).to(memory_format=torch.channels_last)
+            self.model.eval()
+
+            # Host-to-device copies are issued on their own stream on the GPU.
+            self._copy_stream = torch.cuda.Stream() if self.device == "cuda" else None
+
             self.processor = SamProcessor.from_pretrained(model_name)
+
+            # Preprocessing settings of the processor, applied to tensors
+            # directly in _preprocess.
+            image_processor = self.processor.image_processor
+            self._longest_edge = image_processor.size["longest_edge"]
+            self._pad_size = (image_processor.pad_size["height"], image_processor.pad_size["width"])
+            self._pixel_mean = torch.tensor(image_processor.image_mean, device=self.device).view(1, -1, 1, 1)
+            self._pixel_std = torch.tensor(image_processor.image_std, device=self.device).view(1, -1, 1, 1)
+
+            # Image embeddings of recently embedded images, least recently used
+            # first, so prompt edits only re-run the prompt encoder and decoder.
+            # Each entry is (embeddings, original_sizes, reshaped_input_sizes).
+            self._embedding_cache = OrderedDict()
+            self._lock = threading.RLock()
+
+            # Host buffer the returned mask is written into, reallocated only
+            # when the tile size changes.
+            self._mask_buffer = None
             print("--- SAM Model Initialized Successfully ---\n")
 
         except Exception as e:
             print(f"FATAL: Failed to initialize SAM Model. Error: {e}")
             raise
 
+    def _inference_context(self):
+        """
+        Returns the context used for every forward pass: inference mode, plus
+        autocast to self.dtype when running on the GPU.
+        """
+        stack = contextlib.ExitStack()
+        stack.enter_context(torch.inference_mode())
+        if self.device == "cuda":
+            stack.enter_context(torch.autocast(device_type=self.device, dtype=self.dtype))
+        return stack
+
+    def _to_device(self, tensor: torch.Tensor) -> torch.Tensor:
+        """
+        Moves a CPU tensor to the model's device. On the GPU the tensor is
+        staged in pinned memory and copied asynchronously on the copy stream;
+        the current stream waits for the copy before using the result.
+        """
+        if self._copy_stream is None:
+            return tensor.to(self.device)
+
+        pinned = tensor.pin_memory()
+        with torch.cuda.stream(self._copy_stream):
+            on_device = pinned.to(self.device, non_blocking=True)
+        current_stream = torch.cuda.current_stream()
+        current_stream.wait_stream(self._copy_stream)
+        on_device.record_stream(current_stream)
+        return on_device
+
+    @staticmethod
+    def _image_id(image_array: np.ndarray) -> str:
+        """
+        Returns a content hash identifying an image array.
+        """
+        digest = hashlib.blake2b(np.ascontiguousarray(image_array).data, digest_size=16)
+        digest.update(str(image_array.shape).encode())
+        return digest.hexdigest()
+
+    def _preprocess(self, image_array: np.ndarray) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Prepares an image for the image encoder the way SamProcessor does,
+        but on tensors: the longest edge is resized to the model's input size,
+        pixels are normalized, and the bottom and right are zero-padded.
+        Resized pixels are rounded to integers as the processor's PIL resize
+        does, and agree with it to within one intensity level.
+
+        Returns:
+            Tuple: (pixel values, original sizes, reshaped input sizes)
+        """
+        old_h, old_w = image_array.shape[:2]
+        scale = self._longest_edge / max(old_h, old_w)
+        new_h, new_w = int(old_h * scale + 0.5), int(old_w * scale + 0.5)
+
+        pixels = self._to_device(torch.from_numpy(image_array)).permute(2, 0, 1).unsqueeze(0).float()
+        pixels = F.interpolate(pixels, size=(new_h, new_w), mode="bilinear", align_corners=False, antialias=True)
+        pixels = (pixels.round_().clamp_(0, 255) / 255 - self._pixel_mean) / self._pixel_std
+        pixels = F.pad(pixels, (0, self._pad_size[1] - new_w, 0, self._pad_size[0] - new_h))
+
+        pixel_values = pixels.to(self.dtype).contiguous(memory_format=torch.channels_last)
+        return pixel_values, torch.tensor([[old_h, old_w]]), torch.tensor([[new_h, new_w]])
+
+    def embed_image(self, image_array: np.ndarray, image_id: Optional[Hashable] = None) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Runs the image encoder and caches the embedding, unless the image
+        identified by image_id is already cached. The cache holds the last
+        EMBEDDING_CACHE_SIZE images.
+
+        Args:
+            image_array (np.ndarray): The input image as a NumPy array (H, W, C).
+            image_id (Optional): A key identifying the image. Defaults to a
+                                 hash of the array contents.
+
+        Returns:
+            Tuple: (image embeddings, original sizes, reshaped input sizes)
+        """
+        if image_id is None:
+            image_id = self._image_id(image_array)
+
+        # Serialized with run_inference, as prefetching may embed tiles from a
+        # background thread.
+        with self._lock:
+            if image_id in self._embedding_cache:
+                self._embedding_cache.move_to_end(image_id)
+                return self._embedding_cache[image_id]
+
+            pixel_values, original_sizes, reshaped_input_sizes = self._preprocess(image_array)
+            with self._inference_context():
+                embeddings = self.model.get_image_embeddings(pixel_values)
+
+            entry = (embeddings, original_sizes, reshaped_input_sizes)
+            self._embedding_cache[image_id] = entry
+            if len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+            return entry
+
+    def _prompt_tensors(self,
+                        points: Optional[List[Tuple[int, int]]],
+                        labels: Optional[List[int]],
+                        box: Optional[List[int]],
+                        original_sizes: torch.Tensor,
+                        reshaped_input_sizes: torch.Tensor) -> dict:
+        """
+        Converts prompts in original image pixels to the tensors the model
+        expects, rescaled to the resized image as SamProcessor would.
+        """
+        old_h, old_w = original_sizes[0].tolist()
+        new_h, new_w = reshaped_input_sizes[0].tolist()
+        scale = torch.tensor([new_w / old_w, new_h / old_h], dtype=torch.float64)
+
+        prompts = {}
+        if points:
+            # Shape (batch, point_batch, n_points, 2)
+            prompts["input_points"] = self._to_device((torch.tensor(points, dtype=torch.float64) * scale)[None, None])
+        if labels:
+            prompts["input_labels"] = self._to_device(torch.tensor(labels, dtype=torch.int64)[None, None])
+        if box:
+            # Shape (batch, n_boxes, 4)
+            prompts["input_boxes"] = self._to_device((torch.tensor(box, dtype=torch.float64).view(2, 2) * scale).view(1, 1, 4))
+        return prompts
+
     def run_inference(self,
                       image_array: np.ndarray,
                       points: Optional[List[Tuple[int, int]]] = None,
                       labels: Optional[List[int]] = None,
-                      box: Optional[List[int]] = None) -> np.ndarray:
+                      box: Optional[List[int]] = None,
+                      image_id: Optional[Hashable] = None) -> np.ndarray:
         """
         Runs inference on a single image with a set of point and/or box prompts.
 
+        The image embedding is computed once per image and reused whenever a
+        recently embedded image is prompted again, so only the first call on
+        a tile pays for the image encoder.
+
         Args:
             image_array (np.ndarray): The input image as a NumPy array (H, W, C).
             points (Optional): A list of (x, y) coordinates for the point prompts.
             labels (Optional): A list of labels for each point (1 for positive, 0 for negative).
             box (Optional): A list representing the bounding box [x_min, y_min, x_max, y_max].
+            image_id (Optional): A key identifying the image, e.g. the tile's
+                                 UID. Defaults to a hash of the array contents.
 
         Returns:
             np.ndarray: A 2D NumPy array representing the segmentation mask.
+                        The array is reused by the next call, so copy it to
+                        keep an earlier mask.
         """
-        image_pil = Image.fromarray(image_array)
-
-        # The processor expects inputs in a specific nested list format.
-        input_points = [points] if points else None
-        input_labels = [labels] if labels else None
-        input_boxes = [[box]] if box else None
-
-        # Process the image and prompts.
-        inputs = self.processor(
-            image_pil,
-            input_points=input_points,
-            input_labels=input_labels,
-            input_boxes=input_boxes,
-            return_tensors="pt"
-        ).to(self.device)
+        with self._lock:
+            embeddings, original_sizes, reshaped_input_sizes = self.embed_image(image_array, image_id)
 
-        # Run the model in inference mode.
-        with torch.no_grad():
-            outputs = self.model(**inputs)
+            # Run the prompt encoder and mask decoder on the cached embedding.
+            with self._inference_context():
+                outputs = self.model(
+                    image_embeddings=embeddings,
+                    multimask_output=True,
+                    **self._prompt_tensors(points, labels, box, original_sizes, reshaped_input_sizes)
+                )
 
-        # Get the segmentation mask from the model output.
-        masks = self.processor.image_processor.post_process_masks(
-            outputs.pred_masks.cpu(),
-            inputs["original_sizes"].cpu(),
-            inputs["reshaped_input_sizes"].cpu()
-        )
+            # Get the segmentation mask from the model output. This follows the
+            # processor's post_process_masks (upscale to the padded input, crop the
+            # padding, resize to the original image, threshold at 0) on the device,
+            # for the first mask only, so just the final uint8 mask is copied back.
+            low_res_mask = outputs.pred_masks[0, :1, :1].float()
+            new_h, new_w = reshaped_input_sizes[0].tolist()
+            mask_logits = F.interpolate(low_res_mask, self._pad_size, mode="bilinear", align_corners=False)
+            mask_logits = F.interpolate(
+                mask_logits[..., :new_h, :new_w],
+                tuple(original_sizes[0].tolist()),
+                mode="bilinear",
+                align_corners=False
+            )
 
-        mask = masks[0][0][0].numpy().astype(np.uint8)
+            mask_shape = tuple(mask_logits.shape[-2:])
+            if self._mask_buffer is None or self._mask_buffer.shape != mask_shape:
+                self._mask_buffer = np.empty(mask_shape, dtype=np.uint8)
+            torch.from_numpy(self._mask_buffer).copy_(mask_logits[0, 0] > 0)
 
-        return mask
+            return self._mask_buffer
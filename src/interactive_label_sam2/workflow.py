@@ -0,0 +1,139 @@
+# src/interactive_label_sam2/workflow.py
+
+import geopandas as gpd
+import numpy as np
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from .data_management import get_feature_info
+from .gcs_utils import GCSImageLoader, get_image_info_for_uid
+
+def load_tile_for_uid(uid: str,
+                      arts_gdf: gpd.GeoDataFrame,
+                      correspondence_gdf: gpd.GeoDataFrame,
+                      gcs_loader: GCSImageLoader,
+                      buffer_distance: float = 384) -> Tuple[Optional[Tuple[np.ndarray, dict]], Optional[str]]:
+    """
+    Reads the basemap tile centered on an RTS feature.
+
+    Args:
+        uid (str): The unique identifier for the RTS feature.
+        arts_gdf (gpd.GeoDataFrame): Positive features, as returned by
+                                     load_and_filter_arts_data.
+        correspondence_gdf (gpd.GeoDataFrame): As returned by load_correspondence_data.
+        gcs_loader (GCSImageLoader): The loader used to find and read the tile.
+        buffer_distance (float): Half the tile's side length, in the CRS units.
+
+    Returns:
+        Tuple: A tuple containing:
+               - (image array, profile) of the tile around the feature's
+                 centroid, or None if it cannot be loaded.
+               - None if the tile was loaded, otherwise why it was not:
+                 'rejected_not_in_arts' if the feature is not found,
+                 'no_basemap' if the feature has no basemap image, or
+                 'rejected_bad_imagery' if the tile cannot be read.
+    """
+    # --- 1. Locate the feature ---
+    feature_info = get_feature_info(uid, arts_gdf)
+    if feature_info is None:
+        return None, 'rejected_not_in_arts'
+    _, centroid = feature_info
+
+    # --- 2. Find the basemap image for it ---
+    image_info_list = get_image_info_for_uid(uid, correspondence_gdf)
+    if not image_info_list:
+        return None, 'no_basemap'
+
+    # --- 3. Read the AOI around the centroid ---
+    centroid_gs = gpd.GeoSeries([centroid], crs=arts_gdf.crs)
+    aoi_gdf = gpd.GeoDataFrame(geometry=centroid_gs.buffer(buffer_distance))
+    gcs_paths = gcs_loader.find_image_paths([image_info_list[0]])
+    tile_data = gcs_loader.get_tile_from_paths(gcs_paths, aoi_gdf)
+    if not tile_data:
+        return None, 'rejected_bad_imagery'
+    return tile_data, None
+
+def stretch_rgb(image_array: np.ndarray) -> np.ndarray:
+    """
+    Contrast-stretches a tile's first three bands between their 2nd and 98th
+    percentiles for display.
+
+    Args:
+        image_array (np.ndarray): Tile of non-negative integers, shaped
+                                  (bands, height, width).
+
+    Returns:
+        np.ndarray: RGB image of shape (height, width, 3) and dtype uint8,
+                    black if the bands are all zero.
+    """
+    rgb_array = image_array[:3]
+    if not np.any(rgb_array):
+        return np.zeros((rgb_array.shape[1], rgb_array.shape[2], 3), dtype=np.uint8)
+
+    # 2nd/98th percentiles from a histogram of the integer band values,
+    # which avoids sorting the whole tile as np.percentile does.
+    cdf = np.cumsum(np.bincount(rgb_array.ravel()))
+    p2, p98 = np.searchsorted(cdf, (0.02 * cdf[-1], 0.98 * cdf[-1]))
+    # Stretch in a single float32 buffer; a flat tile (p98 == p2) is not scaled.
+    stretched = np.subtract(rgb_array, p2, dtype=np.float32)
+    stretched *= 255.0 / max(p98 - p2, 1)
+    np.clip(stretched, 0, 255, out=stretched)
+    return np.transpose(stretched.astype(np.uint8), (1, 2, 0))
+
+class Prefetcher:
+    """
+    Runs a load function for upcoming keys (e.g. the next UIDs to label) in
+    background threads, so their results are ready when they are requested.
+    """
+    def __init__(self, load_fn: Callable[[Hashable], object], max_workers: int = 2):
+        """
+        Args:
+            load_fn (Callable): Loads the value for one key. It runs on worker
+                                threads and must be safe to call concurrently.
+            max_workers (int): Number of keys loaded at the same time.
+        """
+        self._load_fn = load_fn
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, keys: Iterable[Hashable]):
+        """
+        Starts loading the given keys. Loads already started for these keys
+        are kept; those for any other key are dropped, and cancelled if they
+        have not started yet.
+        """
+        keys = list(keys)
+        with self._lock:
+            futures = {key: self._futures.pop(key) for key in keys if key in self._futures}
+            for future in self._futures.values():
+                future.cancel()
+            for key in keys:
+                if key not in futures:
+                    futures[key] = self._executor.submit(self._load_fn, key)
+            self._futures = futures
+
+    def get(self, key: Hashable):
+        """
+        Returns the value for a key, waiting for its prefetch if one was
+        started and loading it on the calling thread otherwise.
+        """
+        with self._lock:
+            future = self._futures.pop(key, None)
+
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Warning: Prefetch of {key} failed, loading it again. Error: {e}", file=sys.stderr)
+        return self._load_fn(key)
+
+    def shutdown(self):
+        """
+        Cancels pending loads and stops the worker threads.
+        """
+        with self._lock:
+            self._futures.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -2,8 +2,8 @@
 
 from pathlib import Path
 import sys
-import matplotlib.pyplot as plt
 import numpy as np
+from PIL import Image
 import rasterio
 import geopandas as gpd
 
@@ -16,6 +16,7 @@ from src.interactive_label_sam2.gcs_utils import (
     get_image_info_for_uid, 
     GCSImageLoader
 )
+from src.interactive_label_sam2.workflow import stretch_rgb
 
 def run_test():
     """
@@ -52,6 +53,9 @@ def run_test():
             print("Test failed: Could not find any image info.")
             return
 
+        # Rows for this UID, sliced from the sorted UID index.
+        uid_features = correspondence_gdf.loc[test_uid:test_uid]
+
         # --- 5. Loop through each target image and test it individually ---
         for image_info in image_info_list:
             print(f"\n--- Testing Image ID: {image_info['image_id']} for Year: {image_info['year']} ---")
@@ -59,10 +63,9 @@ def run_test():
             # --- 5a. Find the specific polygon for THIS image ---
             print("[Step 4a] Finding specific polygon for this image...")
             
-            feature_gdf = correspondence_gdf[
-                (correspondence_gdf['UID'] == test_uid) &
-                (correspondence_gdf['id'] == image_info['image_id']) &
-                (correspondence_gdf['planet_basemap_year'] == image_info['year'])
+            feature_gdf = uid_features[
+                (uid_features['id'] == image_info['image_id']) &
+                (uid_features['planet_basemap_year'] == image_info['year'])
             ]
 
             if feature_gdf.empty:
@@ -74,8 +77,8 @@ def run_test():
             centroid = feature_gdf.geometry.iloc[0].centroid
             centroid_gs = gpd.GeoSeries([centroid], crs=feature_gdf.crs)
             buffer_distance = 384 
-            aoi_polygon = centroid_gs.buffer(buffer_distance)
-            aoi_bounds = aoi_polygon.total_bounds
+            aoi_gdf = gpd.GeoDataFrame(geometry=centroid_gs.buffer(buffer_distance))
+            aoi_bounds = aoi_gdf.total_bounds
             print(f"Using AOI bounds: {aoi_bounds}")
 
             # --- 5c. Find exact path using the loader's fast in-memory search ---
@@ -87,7 +90,7 @@ def run_test():
 
             # --- 5d. Attempt to Download the Image Tile using the buffered AOI ---
             print("\n[Step 4d] Attempting to download image tile from GCS...")
-            tile_data = gcs_loader.get_tile_from_paths(gcs_paths, aoi_bounds)
+            tile_data = gcs_loader.get_tile_from_paths(gcs_paths, aoi_gdf)
             
             if tile_data:
                 image_array, profile = tile_data
@@ -97,28 +100,18 @@ def run_test():
                 print(f"\n[Step 4e] Saving a preview image to '{output_dir.name}/test_tile.png'...")
                 rgb_array = image_array[:3]
                 
-                if np.max(rgb_array) > 0:
-                    p2, p98 = np.percentile(rgb_array, (2, 98))
-                    rgb_stretched = np.clip((rgb_array - p2) * 255.0 / (p98 - p2), 0, 255).astype(np.uint8)
-                    rgb_transposed = np.transpose(rgb_stretched, (1, 2, 0))
-                else:
+                if not np.any(rgb_array):
                     print("Warning: Image data is all zeros. Creating a black preview.")
-                    rgb_transposed = np.zeros((image_array.shape[1], image_array.shape[2], 3), dtype=np.uint8)
+                # Same stretch as the notebook's display; black for an all-zero tile.
+                rgb_transposed = stretch_rgb(image_array)
 
                 transform = profile['transform']
                 col, row = ~transform * (centroid.x, centroid.y)
+                print(f"Centroid falls at pixel (col={col:.1f}, row={row:.1f}) of the tile.")
 
-                fig, ax = plt.subplots(1, figsize=(6, 6))
-                ax.imshow(rgb_transposed)
-                ax.scatter([col], [row], c='red', s=50, marker='+', label='Centroid')
-                ax.set_title(f"Test Tile for UID: {test_uid[:8]}")
-                ax.legend()
-                ax.axis('off')
-                
-                # Save the file to the correct output directory
+                # Write the RGB array straight to PNG; no figure is needed.
                 output_image_path = output_dir / "test_tile.png"
-                fig.savefig(output_image_path, bbox_inches='tight', pad_inches=0.1)
-                plt.close(fig)
+                Image.fromarray(rgb_transposed).save(output_image_path, optimize=False, compress_level=1)
                 print("Preview image saved successfully.")
 
                 print("\n--- GCS Access Test Finished Successfully! ---")